@@ -1,9 +1,14 @@
-import json
+import atexit
+import heapq
 import os
+import sys
+from operator import attrgetter, itemgetter
 from datetime import datetime, timezone, date
+from functools import lru_cache
 from typing import Any, Optional
 
 import fortnite_api
+import msgspec
 from dateutil.parser import isoparse
 
 
@@ -12,29 +17,66 @@ TOP_JSON = os.path.join(OUT_DIR, "top.json")
 
 TOP_LIMIT = 60  # how many items to show on homepage
 
+# Fetched in one C-level call per item instead of separate getattr()s
+_ITEM_FIELDS = attrgetter("name", "type", "rarity", "images", "shop_history")
+_ENUM_ATTRS = ("display_value", "value", "name")
+
+_clients = {}
+
+
+class TopItem(msgspec.Struct):
+    """One entry in top.json's "items" list."""
+    id: str
+    name: Optional[str]
+    type: Optional[str]
+    rarity: Optional[str]
+    icon: Optional[str]
+    last_seen: str
+    days_since: int
+
+
+class TopPayload(msgspec.Struct):
+    """Contents of top.json."""
+    updated_utc: datetime
+    count: int
+    items: list[TopItem]
+
 
 # -----------------------
 # Safety helpers
 # -----------------------
 
-def json_safe(x: Any) -> Any:
-    """Convert ANY object into JSON-safe data."""
-    if x is None:
-        return None
-    if isinstance(x, (str, int, float, bool)):
-        return x
-    if isinstance(x, (date, datetime)):
-        try:
-            if isinstance(x, datetime) and x.tzinfo is None:
-                x = x.replace(tzinfo=timezone.utc)
-            return x.isoformat()
-        except Exception:
-            return str(x)
+def _json_safe_identity(x: Any) -> Any:
+    return x
+
+
+def _json_safe_none(x: Any) -> None:
+    return None
+
+
+def _json_safe_date(x: Any) -> str:
+    try:
+        if isinstance(x, datetime) and x.tzinfo is None:
+            x = x.replace(tzinfo=timezone.utc)
+        return x.isoformat()
+    except Exception:
+        return str(x)
+
+
+def _json_safe_dict(x: dict) -> dict:
+    return {str(k): json_safe(v) for k, v in x.items()}
 
-    if isinstance(x, dict):
-        return {str(k): json_safe(v) for k, v in x.items()}
-    if isinstance(x, (list, tuple, set)):
-        return [json_safe(v) for v in x]
+
+def _json_safe_seq(x: Any) -> list:
+    return [json_safe(v) for v in x]
+
+
+def _json_safe_other(x: Any) -> Any:
+    # Subclasses of handled types (e.g. str/int enums) use their base's handler
+    for base in type(x).__mro__[1:]:
+        handler = _JSON_SAFE_DISPATCH.get(base)
+        if handler is not None:
+            return handler(x)
 
     # Fortnite Asset objects often have .url
     url = getattr(x, "url", None)
@@ -42,7 +84,7 @@ def json_safe(x: Any) -> Any:
         return url
 
     # Enums often have these
-    for attr in ("display_value", "value", "name"):
+    for attr in _ENUM_ATTRS:
         v = getattr(x, attr, None)
         if isinstance(v, str):
             return v
@@ -53,17 +95,63 @@ def json_safe(x: Any) -> Any:
         return None
 
 
+# Exact-type lookup for common values; everything else takes the slow path
+_JSON_SAFE_DISPATCH = {
+    str: _json_safe_identity,
+    int: _json_safe_identity,
+    float: _json_safe_identity,
+    bool: _json_safe_identity,
+    type(None): _json_safe_none,
+    date: _json_safe_date,
+    datetime: _json_safe_date,
+    dict: _json_safe_dict,
+    list: _json_safe_seq,
+    tuple: _json_safe_seq,
+    set: _json_safe_seq,
+}
+
+
+def json_safe(x: Any) -> Any:
+    """Convert ANY object into JSON-safe data."""
+    return _JSON_SAFE_DISPATCH.get(type(x), _json_safe_other)(x)
+
+
+@lru_cache(maxsize=4096)
+def _to_iso_date_str(s: str) -> Optional[str]:
+    # Many items share the same shop dates, so cache by raw string
+    try:
+        try:
+            # stdlib C parser handles the API's canonical ISO-8601 strings
+            parsed = datetime.fromisoformat(s.replace("Z", "+00:00"))
+        except ValueError:
+            parsed = isoparse(s)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.date().isoformat()
+    except Exception:
+        return None
+
+
+def json_str(x: Any) -> Optional[str]:
+    """json_safe() narrowed to a plain str (or None) for TopItem fields."""
+    v = json_safe(x)
+    if v is None or type(v) is str:
+        return v
+    if isinstance(v, str):
+        return str.__str__(v)  # underlying value of str subclasses (str enums)
+    return str(v)
+
+
+def intern_str(x: Optional[str]) -> Optional[str]:
+    """Share one string object for low-cardinality values like rarity/type."""
+    return sys.intern(x) if x is not None else None
+
+
 def to_iso_date(x: Any) -> Optional[str]:
     if x is None:
         return None
     if isinstance(x, str):
-        try:
-            parsed = isoparse(x)
-            if parsed.tzinfo is None:
-                parsed = parsed.replace(tzinfo=timezone.utc)
-            return parsed.date().isoformat()
-        except Exception:
-            return None
+        return _to_iso_date_str(x)
     try:
         if getattr(x, "tzinfo", None) is None and hasattr(x, "replace"):
             x = x.replace(tzinfo=timezone.utc)
@@ -74,95 +162,148 @@ def to_iso_date(x: Any) -> Optional[str]:
     return None
 
 
-def days_since(iso_date: Optional[str]) -> Optional[int]:
+def latest_iso_date(history) -> Optional[str]:
+    """Newest shop date in history, parsing only the max entry when possible.
+
+    Assumes all entries share one UTC offset (fortnite-api parses shop dates
+    as UTC). With mixed offsets, max() compares instants (or raw strings)
+    while to_iso_date() keeps each value's own offset, so the result can
+    differ from the max over every entry's date.
+    """
+    try:
+        latest = to_iso_date(max(history))
+    except TypeError:
+        latest = None
+    if latest:
+        return latest
+    return max((d for d in map(to_iso_date, history) if d), default=None)
+
+
+def days_since(iso_date: Optional[str], today_ordinal: Optional[int] = None) -> Optional[int]:
     if not iso_date:
         return None
-    last = date.fromisoformat(iso_date)
-    today = datetime.now(timezone.utc).date()
-    return (today - last).days
+    if today_ordinal is None:
+        today_ordinal = datetime.now(timezone.utc).date().toordinal()
+    # Plain int subtraction, no timedelta per item
+    return today_ordinal - date.fromisoformat(iso_date).toordinal()
 
 
-def pick_icon(item) -> Optional[str]:
-    images = getattr(item, "images", None)
+def pick_icon(images) -> Optional[str]:
     if images is None:
         return None
     icon = getattr(images, "icon", None) or getattr(images, "small_icon", None)
-    return json_safe(icon)
+    return json_str(icon)
 
 
-# -----------------------
-# Main script
-# -----------------------
+def write_top_json(path: str, updated_utc: datetime, items: list[TopItem]) -> None:
+    payload = TopPayload(updated_utc=updated_utc, count=len(items), items=items)
+    with open(path, "wb") as f:
+        f.write(msgspec.json.encode(payload))
 
-def main():
-    os.makedirs(OUT_DIR, exist_ok=True)
 
-    api_key = os.environ.get("FORTNITE_API_KEY")
-    flags = fortnite_api.ResponseFlags.INCLUDE_SHOP_HISTORY
-
-    results = []
-
-    with fortnite_api.SyncClient(api_key=api_key, response_flags=flags) as client:
-
-        # 1) Get ALL cosmetics (with history)
-        print("Fetching cosmetics...")
-        all_cosmetics = client.fetch_cosmetics_all()
-        br_items = all_cosmetics.br
-
-        # 2) Get CURRENT SHOP
-        print("Fetching current shop...")
-        shop = client.fetch_shop()
-
-        shop_ids = set()
-        for entry in shop.entries:
-            for item in entry.items:
-                shop_ids.add(item.id)
-
-        print(f"Current shop items: {len(shop_ids)}")
+def enrich_item(item_id: str, item, today_ordinal: int) -> Optional[tuple]:
+    """Build the sortable row for one shop item, or None if it has no shop dates."""
+    name, item_type, rarity, images, history = _ITEM_FIELDS(item)
+    if not history:
+        return None  # skip items with no shop history
 
-        # 3) Process only items currently in shop
-        for item in br_items:
+    last_seen = latest_iso_date(history)
+    if not last_seen:
+        return None
 
-            item_id = getattr(item, "id", None)
-            if item_id not in shop_ids:
-                continue  # skip if not currently in shop
+    d_since = days_since(last_seen, today_ordinal)
+    return (-d_since, item_id, name, item_type, rarity, images, last_seen, d_since)
 
-            history = getattr(item, "shop_history", None) or []
-            if not history:
-                continue  # skip items with no shop history
 
-            iso_dates = [to_iso_date(h) for h in history]
-            iso_dates = [d for d in iso_dates if d]
-            if not iso_dates:
-                continue
+def get_client(api_key: Optional[str], flags) -> "fortnite_api.SyncClient":
+    """Shared API client per (api_key, flags), so repeated runs reuse connections.
 
-            last_seen = max(iso_dates)
-            d_since = days_since(last_seen)
+    Clients stay open after main() returns or raises; they are closed at
+    interpreter exit.
+    """
+    key = (api_key, flags)
+    client = _clients.get(key)
+    if client is None:
+        client = fortnite_api.SyncClient(api_key=api_key, response_flags=flags).__enter__()
+        atexit.register(client.__exit__, None, None, None)
+        _clients[key] = client
+    return client
 
-            results.append({
-                "id": item_id,
-                "name": getattr(item, "name", None),
-                "type": getattr(item, "type", None),
-                "rarity": getattr(item, "rarity", None),
-                "icon": pick_icon(item),
-                "last_seen": last_seen,
-                "days_since": d_since
-            })
 
-    # 4) Sort by rarity (longest ago first)
-    results.sort(key=lambda x: -(x["days_since"] or 0))
+# -----------------------
+# Main script
+# -----------------------
 
-    # 5) Keep top N
-    top = results[:TOP_LIMIT]
+def main():
+    os.makedirs(OUT_DIR, exist_ok=True)
 
-    payload = {
-        "updated_utc": datetime.now(timezone.utc).isoformat(),
-        "count": len(top),
-        "items": json_safe(top)
-    }
+    api_key = os.environ.get("FORTNITE_API_KEY")
+    flags = fortnite_api.ResponseFlags.INCLUDE_SHOP_HISTORY
 
-    with open(TOP_JSON, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False)
+    # Rows are (sort_key, id, name, type, rarity, images, last_seen, days_since);
+    # dicts are only built for the TOP_LIMIT rows that get written
+    rows = []
+    # One timestamp per run: used for day counts and updated_utc
+    now = datetime.now(timezone.utc)
+    today_ordinal = now.date().toordinal()
+
+    client = get_client(api_key, flags)
+
+    # 1) Get ALL cosmetics (with history)
+    print("Fetching cosmetics...")
+    all_cosmetics = client.fetch_cosmetics_all()
+    br_items = all_cosmetics.br
+
+    # 2) Get CURRENT SHOP
+    print("Fetching current shop...")
+    shop = client.fetch_shop()
+
+    shop_ids = set()
+    # Only BR cosmetics can match br_items; entries also carry tracks, cars, etc.
+    pending_br_ids = set()
+    for entry in shop.entries:
+        for item in entry.items:
+            shop_ids.add(item.id)
+        for cosmetic in getattr(entry, "br", None) or ():
+            pending_br_ids.add(cosmetic.id)
+
+    print(f"Current shop items: {len(shop_ids)}")
+
+    # 3) Process only items currently in shop
+    for item in br_items:
+
+        item_id = getattr(item, "id", None)
+        if item_id not in shop_ids:
+            continue  # skip if not currently in shop
+
+        row = enrich_item(item_id, item, today_ordinal)
+        if row is not None:
+            rows.append(row)
+
+        if item_id in pending_br_ids:
+            pending_br_ids.discard(item_id)
+            if not pending_br_ids:
+                break  # every BR cosmetic in the shop already found
+
+    # 4) Keep top N by rarity (longest ago first) in one pass;
+    # same order as a stable sort + slice
+    top_rows = heapq.nsmallest(TOP_LIMIT, rows, key=itemgetter(0))
+
+    # 5) Build output items
+    top = [
+        TopItem(
+            id=item_id,
+            name=json_str(name),
+            type=intern_str(json_str(item_type)),
+            rarity=intern_str(json_str(rarity)),
+            icon=pick_icon(images),
+            last_seen=last_seen,
+            days_since=d_since,
+        )
+        for _, item_id, name, item_type, rarity, images, last_seen, d_since in top_rows
+    ]
+
+    write_top_json(TOP_JSON, now, top)
 
     print(f"Wrote {TOP_JSON} with {len(top)} items")
 